@@ -0,0 +1,71 @@
+"""Measure how long `import red_postgres` takes in a fresh interpreter.
+
+The baseline imports the heavy dependencies along with the package, which is what
+importing `red_postgres` cost before they were imported lazily.
+
+Usage:
+    python benchmarks/import_time.py [runs]
+"""
+
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+root = Path(__file__).parent.parent
+heavy_modules = (
+    "asyncpg",
+    "discord.ext.commands",
+    "piccolo.engine.postgres",
+    "piccolo.table",
+)
+
+snippet = """
+import sys, time
+start = time.perf_counter()
+{imports}
+elapsed = time.perf_counter() - start
+loaded = [m for m in {heavy_modules!r} if m in sys.modules]
+print(elapsed, ",".join(loaded))
+"""
+
+
+def measure(imports: str, runs: int) -> tuple[float, str]:
+    """Get the median import time in ms and the heavy modules that were loaded"""
+    code = snippet.format(imports=imports, heavy_modules=heavy_modules)
+    timings = []
+    loaded = ""
+    for _ in range(runs):
+        res = subprocess.run(
+            [sys.executable, "-c", code],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=True,
+            cwd=str(root),
+        )
+        elapsed, _, loaded = res.stdout.decode().strip().partition(" ")
+        timings.append(float(elapsed) * 1000)
+    return statistics.median(timings), loaded
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    try:
+        baseline, _ = measure(f"import red_postgres, {', '.join(heavy_modules)}", runs)
+    except subprocess.CalledProcessError:
+        print(f"Baseline needs {', '.join(heavy_modules)} to be installed")
+        baseline = None
+    lazy, loaded = measure("import red_postgres", runs)
+
+    print(f"Median over {runs} runs")
+    if baseline is not None:
+        print(f"  eager (baseline):    {baseline:.2f}ms")
+    print(f"  import red_postgres: {lazy:.2f}ms")
+    if baseline is not None:
+        saved = baseline - lazy
+        print(f"  saved:               {saved:.2f}ms ({baseline / lazy:.1f}x faster)")
+    print(f"Heavy modules loaded by red_postgres: {loaded or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
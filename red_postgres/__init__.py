@@ -1,12 +1,27 @@
-from .engine import diagnose_issues, register_cog, reverse_migration, run_migrations
-from .errors import ConnectionTimeoutError, DirectoryError, UNCPathError
+from .aggregator import CounterAggregator
+from .engine import (
+    diagnose_issues,
+    register_cog,
+    reverse_migration,
+    run_migrations,
+    run_migrations_parallel,
+)
+from .errors import (
+    ConnectionTimeoutError,
+    DirectoryError,
+    MigrationLockError,
+    UNCPathError,
+)
 
 __all__ = [
     "ConnectionTimeoutError",
+    "CounterAggregator",
     "DirectoryError",
+    "MigrationLockError",
     "UNCPathError",
     "diagnose_issues",
     "register_cog",
     "reverse_migration",
     "run_migrations",
+    "run_migrations_parallel",
 ]
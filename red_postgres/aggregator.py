@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import defaultdict
+from numbers import Integral, Number
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from piccolo.columns import Column
+    from piccolo.engine.postgres import PostgresEngine
+    from piccolo.table import Table
+
+log = logging.getLogger("red.postgres.aggregator")
+
+# Serial types can't be used in casts, map them to their underlying type
+_CAST_TYPES = {
+    "SERIAL": "INTEGER",
+    "BIGSERIAL": "BIGINT",
+    "SMALLSERIAL": "SMALLINT",
+}
+
+
+class CounterAggregator:
+    """Write-behind aggregator for high-frequency counter increments.
+
+    Increments are accumulated in memory per (table, key, column) and flushed
+    periodically as a single set-based statement per table, instead of issuing an
+    `UPDATE ... SET x = x + 1` for every event.
+
+    Rows are matched on the table's primary key.
+
+    Example:
+        ```python
+        self.db = await register_cog(self, config, [Member])
+        self.counters = CounterAggregator(self.db)
+        self.counters.start()
+
+        # In a listener
+        self.counters.increment(Member, user.id, Member.messages)
+
+        # In cog_unload
+        await self.counters.close()
+        ```
+    """
+
+    def __init__(
+        self,
+        engine: PostgresEngine,
+        interval: float = 10.0,
+        upsert: bool = False,
+    ):
+        """
+        Args:
+            engine (PostgresEngine): The registered engine to flush through.
+            interval (float, optional): Seconds between flushes. Defaults to 10.0.
+            upsert (bool, optional): Insert rows that don't exist yet instead of dropping their deltas.
+                All other columns of the table must have defaults. Defaults to False.
+        """
+        self.engine = engine
+        self.interval = interval
+        self.upsert = upsert
+        # {table: {key: {column_name: delta}}}
+        self._pending: dict[type[Table], dict] = self._new_pending()
+        # Deltas taken by a flush that hasn't committed yet
+        self._inflight: dict[type[Table], dict] = {}
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    def increment(
+        self,
+        table: type[Table],
+        key,
+        column: Column | str,
+        amount: Number = 1,
+    ) -> None:
+        """Queue an increment for a counter column.
+
+        Args:
+            table (type[Table]): The table containing the counter.
+            key: The primary key value of the row.
+            column (Column | str): The counter column, or its name.
+            amount (Number, optional): The amount to add. Defaults to 1.
+
+        Raises:
+            TypeError: If the amount isn't a number, or isn't whole for an integer column.
+        """
+        name = _column_name(table, column)
+        if not isinstance(amount, Number) or isinstance(amount, bool):
+            raise TypeError(f"Counter amount must be a number, not {amount!r}")
+        value_type = table._meta.get_column_by_name(name).value_type
+        if value_type is int and not isinstance(amount, Integral):
+            raise TypeError(f"Counter {name} is an integer column, got {amount!r}")
+        self._pending[table][key][name] += amount
+
+    def pending(self, table: type[Table], key, column: Column | str) -> Number:
+        """Get the uncommitted delta for a counter"""
+        name = _column_name(table, column)
+        delta = 0
+        for source in (self._pending, self._inflight):
+            rows = source.get(table)
+            if rows and key in rows:
+                delta += rows[key].get(name, 0)
+        return delta
+
+    async def get(self, table: type[Table], key, column: Column | str) -> Number:
+        """Read a counter with any pending delta merged in.
+
+        Args:
+            table (type[Table]): The table containing the counter.
+            key: The primary key value of the row.
+            column (Column | str): The counter column, or its name.
+
+        Returns:
+            Number: The stored value plus the unflushed delta.
+        """
+        name = _column_name(table, column)
+        column_name = table._meta.get_column_by_name(name)._meta.db_column_name
+        pk = table._meta.primary_key
+        query = (
+            f'SELECT "{column_name}" FROM {table._meta.get_formatted_tablename()} '
+            f'WHERE "{pk._meta.db_column_name}" = $1::{_cast_type(pk)}'
+        )
+        # Hold the flush lock so a batch can't be both stored and counted as pending
+        async with self._lock:
+            # Read through the same engine the deltas are written with
+            async with self.engine.pool.acquire() as conn:
+                stored = await conn.fetchval(query, key)
+            rows = self._pending.get(table)
+            delta = rows[key].get(name, 0) if rows and key in rows else 0
+            return (stored or 0) + delta
+
+    def start(self) -> None:
+        """Start the periodic flush loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self) -> int:
+        """Stop the flush loop and flush anything still pending.
+
+        This should be awaited in the cog's `cog_unload`, which Red also calls on shutdown.
+        Deltas that still couldn't be written are kept, so `flush` can be retried.
+
+        Returns:
+            int: The number of rows that couldn't be written, 0 if everything was flushed.
+        """
+        if self._task is not None:
+            # Let an in-flight flush finish before cancelling the loop
+            async with self._lock:
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+                self._task = None
+        await self.flush()
+        unwritten = sum(len(rows) for rows in self._pending.values())
+        if unwritten:
+            log.error(f"{unwritten} counter rows could not be written on close")
+        return unwritten
+
+    async def flush(self) -> int:
+        """Write all pending deltas to the database.
+
+        Deltas that fail to write because of a connection problem are merged back so they
+        are retried on the next flush. Deltas rejected by the database, such as invalid values
+        or constraint violations, would fail every time so they are logged and dropped.
+
+        Returns:
+            int: The number of rows written.
+        """
+        async with self._lock:
+            if not self._pending:
+                return 0
+            self._inflight, self._pending = self._pending, self._new_pending()
+            written = 0
+            try:
+                for table in list(self._inflight):
+                    try:
+                        written += await self._flush_table(table, self._inflight[table])
+                    except _permanent_errors() as e:
+                        rows = self._inflight.pop(table)
+                        log.error(
+                            f"Dropping counters for {table._meta.tablename} "
+                            f"rejected by the database: { {k: dict(v) for k, v in rows.items()} }",
+                            exc_info=e,
+                        )
+                    except Exception:
+                        log.exception(
+                            f"Failed to flush counters for {table._meta.tablename}"
+                        )
+                        self._restore(table, self._inflight.pop(table))
+                    else:
+                        del self._inflight[table]
+            finally:
+                # Put back anything left over if the flush was interrupted
+                for table, rows in self._inflight.items():
+                    self._restore(table, rows)
+                self._inflight = {}
+            return written
+
+    def _restore(self, table: type[Table], rows: dict) -> None:
+        """Merge deltas that weren't written back into the pending deltas"""
+        for key, columns in rows.items():
+            for name, delta in columns.items():
+                self._pending[table][key][name] += delta
+
+    async def _flush_table(self, table: type[Table], rows: dict) -> int:
+        """Flush the pending deltas for a single table in one statement"""
+        pk = table._meta.primary_key
+        pk_name = pk._meta.db_column_name
+        names = sorted({name for deltas in rows.values() for name in deltas})
+        keys = list(rows.keys())
+        args = [keys]
+        unnest_args = [f"$1::{_cast_type(pk)}[]"]
+        columns = []
+        for i, name in enumerate(names, start=2):
+            column = table._meta.get_column_by_name(name)
+            columns.append(column._meta.db_column_name)
+            args.append([rows[key].get(name, 0) for key in keys])
+            unnest_args.append(f"${i}::{_cast_type(column)}[]")
+        aliases = ", ".join(f'"{c}"' for c in [pk_name, *columns])
+        values = f"unnest({', '.join(unnest_args)}) AS v({aliases})"
+        tablename = table._meta.get_formatted_tablename()
+
+        if self.upsert:
+            sets = ", ".join(f'"{c}" = t."{c}" + EXCLUDED."{c}"' for c in columns)
+            query = (
+                f"INSERT INTO {tablename} AS t ({aliases}) "
+                f"SELECT * FROM {values} "
+                f'ON CONFLICT ("{pk_name}") DO UPDATE SET {sets}'
+            )
+        else:
+            sets = ", ".join(f'"{c}" = t."{c}" + v."{c}"' for c in columns)
+            query = (
+                f"UPDATE {tablename} AS t SET {sets} "
+                f'FROM {values} WHERE t."{pk_name}" = v."{pk_name}"'
+            )
+
+        async with self.engine.pool.acquire() as conn:
+            status = await conn.execute(query, *args)
+        # Status is "UPDATE <count>" or "INSERT 0 <count>"
+        return int(status.split()[-1])
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    @staticmethod
+    def _new_pending() -> dict:
+        return defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+
+
+def _permanent_errors() -> tuple[type[Exception], ...]:
+    """Get the errors that would fail a flush every time it's retried"""
+    import asyncpg
+
+    return (
+        asyncpg.DataError,
+        asyncpg.IntegrityConstraintViolationError,
+        asyncpg.SyntaxOrAccessError,
+    )
+
+
+def _column_name(table: type[Table], column: Column | str) -> str:
+    """Get the attribute name of a column"""
+    if isinstance(column, str):
+        return table._meta.get_column_by_name(column)._meta.name
+    return column._meta.name
+
+
+def _cast_type(column: Column) -> str:
+    """Get the type to cast an array parameter to for a column"""
+    column_type = column.column_type.upper()
+    return _CAST_TYPES.get(column_type, column_type)
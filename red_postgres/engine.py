@@ -1,20 +1,39 @@
+from __future__ import annotations
+
 import asyncio
 import inspect
 import logging
 import os
+import re
 import subprocess
 import sys
+import weakref
+from functools import lru_cache
 from pathlib import Path
-
-import asyncpg
-from discord.ext.commands import Cog
-from piccolo.engine.postgres import PostgresEngine
-from piccolo.table import Table
-
-from .errors import ConnectionTimeoutError, DirectoryError, UNCPathError
+from typing import TYPE_CHECKING
+
+from .errors import (
+    ConnectionTimeoutError,
+    DirectoryError,
+    MigrationLockError,
+    UNCPathError,
+)
+
+# Heavy dependencies are imported on first use to keep `import red_postgres` fast
+if TYPE_CHECKING:
+    import asyncpg
+    from discord.ext.commands import Cog
+    from piccolo.engine.postgres import PostgresEngine
+    from piccolo.table import Table
 
 log = logging.getLogger("red.postgres")
 piccolo_path = Path(sys.executable).parent / "piccolo"
+migration_id_pattern = re.compile(r"^ID\s*=\s*[\"'](.+?)[\"']", re.MULTILINE)
+# (database name, migrations fingerprint) pairs known to be fully migrated
+_migrated: set[tuple[str, tuple]] = set()
+# Resolved root paths and database names of cog instances
+_roots: weakref.WeakKeyDictionary[Cog, Path] = weakref.WeakKeyDictionary()
+_db_names: weakref.WeakKeyDictionary[Cog, str] = weakref.WeakKeyDictionary()
 
 
 async def register_cog(
@@ -76,21 +95,98 @@ async def run_migrations(
     cog_instance: Cog | Path,
     config: dict,
     trace: bool = False,
+    lock_timeout: float = 60,
 ) -> str:
     """Runs database migrations for a given Discord cog.
 
+    A per-database advisory lock is held while migrating, so when several processes start at once
+    only one of them migrates and the others wait for it to finish, then skip.
+
     Args:
         cog_instance (Cog | Path): The instance of the cog for which to run migrations.
         config (dict): Configuration dictionary containing database connection details.
         trace (bool, optional): Whether to enable tracing for migrations. Defaults to False.
+        lock_timeout (float, optional): Seconds to wait for another process to finish migrating. Defaults to 60.
 
     Returns:
         str: The result of the migration process, including any output messages.
     """
+    import asyncpg
+
+    database_name = _db_name(cog_instance)
+    fingerprint = await asyncio.to_thread(_migrations_fingerprint, cog_instance)
+    if (database_name, fingerprint) in _migrated:
+        return "No migrations need to be run"
+    if await _pending_migrations(cog_instance, config, fingerprint) == []:
+        _migrated.add((database_name, fingerprint))
+        return "No migrations need to be run"
+
     commands = [str(piccolo_path), "migrations", "forwards", _root(cog_instance).stem]
     if trace:
         commands.append("--trace")
-    return await _shell(cog_instance, config, commands, False)
+
+    conn = await asyncpg.connect(**config, timeout=10)
+    try:
+        if not await _acquire_migration_lock(conn, database_name, lock_timeout):
+            log.warning(
+                f"Another process is still migrating {database_name}, skipping migrations"
+            )
+            return "Skipped, another process is running migrations"
+        try:
+            # Another process may have applied the migrations while we waited
+            if await _pending_migrations(cog_instance, config, fingerprint) == []:
+                _migrated.add((database_name, fingerprint))
+                return "No migrations need to be run"
+            return await _shell(cog_instance, config, commands, False)
+        finally:
+            await _release_migration_lock(conn, database_name)
+    finally:
+        await conn.close()
+
+
+async def run_migrations_parallel(
+    cog_instances: list[Cog | Path],
+    config: dict,
+    trace: bool = False,
+    concurrency: int = 4,
+) -> dict[str, str | Exception]:
+    """Runs database migrations for several cogs concurrently.
+
+    Each cog has its own database, so their migrations are independent of each other.
+    A cog failing to migrate doesn't stop the others, its exception is returned as its result instead.
+
+    Args:
+        cog_instances (list[Cog | Path]): The cogs for which to run migrations.
+        config (dict): Configuration dictionary containing database connection details.
+        trace (bool, optional): Whether to enable tracing for migrations. Defaults to False.
+        concurrency (int, optional): Maximum number of cogs to migrate at once. Defaults to 4.
+
+    Raises:
+        ValueError: If more than one cog resolves to the same database name.
+
+    Returns:
+        dict[str, str | Exception]: The result of each cog's migrations, keyed by database name.
+    """
+    database_names = [_db_name(cog) for cog in cog_instances]
+    duplicates = {name for name in database_names if database_names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Cogs share database names: {', '.join(sorted(duplicates))}")
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _run(cog_instance: Cog | Path) -> str:
+        async with semaphore:
+            return await run_migrations(cog_instance, config, trace)
+
+    results = await asyncio.gather(
+        *(_run(cog) for cog in cog_instances), return_exceptions=True
+    )
+    for name, result in zip(database_names, results):
+        if isinstance(result, BaseException) and not isinstance(result, Exception):
+            raise result
+        if isinstance(result, Exception):
+            log.error(f"Failed to run migrations for {name}", exc_info=result)
+    return dict(zip(database_names, results))
 
 
 async def reverse_migration(
@@ -98,6 +194,7 @@ async def reverse_migration(
     config: dict,
     timestamp: str,
     trace: bool = False,
+    lock_timeout: float = 60,
 ) -> str:
     """Reverses a database migration for a given Discord cog to a specific timestamp.
 
@@ -106,10 +203,16 @@ async def reverse_migration(
         config (dict): Configuration dictionary containing database connection details.
         timestamp (str): The timestamp to which the migration should be reversed.
         trace (bool, optional): Whether to enable tracing for migrations. Defaults to False.
+        lock_timeout (float, optional): Seconds to wait for another process to finish migrating. Defaults to 60.
+
+    Raises:
+        MigrationLockError: If another process is still migrating the database after `lock_timeout` seconds.
 
     Returns:
         str: The result of the reverse migration process, including any output messages.
     """
+    import asyncpg
+
     commands = [
         str(piccolo_path),
         "migrations",
@@ -120,7 +223,20 @@ async def reverse_migration(
     if trace:
         commands.append("--trace")
 
-    return await _shell(cog_instance, config, commands, False)
+    database_name = _db_name(cog_instance)
+    conn = await asyncpg.connect(**config, timeout=10)
+    try:
+        if not await _acquire_migration_lock(conn, database_name, lock_timeout):
+            raise MigrationLockError(
+                f"Timed out waiting for another process to finish migrating {database_name}"
+            )
+        try:
+            _forget_migrated(database_name)
+            return await _shell(cog_instance, config, commands, False)
+        finally:
+            await _release_migration_lock(conn, database_name)
+    finally:
+        await conn.close()
 
 
 async def create_migrations(
@@ -186,18 +302,133 @@ async def ensure_database_exists(cog_instance: Cog | Path, config: dict) -> bool
     Returns:
         bool: True if a new database was created
     """
+    import asyncpg
+
     conn = await asyncpg.connect(**config, timeout=10)
     database_name = _db_name(cog_instance)
     try:
         databases = await conn.fetch("SELECT datname FROM pg_database;")
         if database_name not in [db["datname"] for db in databases]:
             await conn.execute(f"CREATE DATABASE {database_name};")
+            # A recreated database needs migrating again
+            _forget_migrated(database_name)
             return True
+    except asyncpg.DuplicateDatabaseError:
+        # Another process created it between the check and the create
+        return False
     finally:
         await conn.close()
     return False
 
 
+async def _acquire_migration_lock(
+    conn: asyncpg.Connection, database_name: str, timeout: float
+) -> bool:
+    """Acquire the advisory lock guarding migrations for a database
+
+    Args:
+        conn (asyncpg.Connection): A connection to the maintenance database, the lock is held for its session
+        database_name (str): The name of the database being migrated
+        timeout (float): Seconds to wait for the lock
+
+    Returns:
+        bool: True if the lock was acquired
+    """
+    key = f"red_postgres:{database_name}"
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext($1));", key):
+        if loop.time() >= deadline:
+            return False
+        log.debug(f"Waiting for migration lock on {database_name}")
+        await asyncio.sleep(0.5)
+    return True
+
+
+async def _release_migration_lock(conn: asyncpg.Connection, database_name: str):
+    """Release the advisory lock guarding migrations for a database"""
+    key = f"red_postgres:{database_name}"
+    await conn.execute("SELECT pg_advisory_unlock(hashtext($1));", key)
+
+
+async def _pending_migrations(
+    cog_instance: Cog | Path, config: dict, fingerprint: tuple
+) -> list[str] | None:
+    """Get the IDs of migrations that haven't been applied to the cog's database
+
+    Returns:
+        list[str] | None: The pending migration IDs, or None if they couldn't be determined
+    """
+    import asyncpg
+
+    migration_ids = await asyncio.to_thread(
+        _migration_ids, _root(cog_instance), fingerprint
+    )
+    if migration_ids is None:
+        return None
+    temp_config = config.copy()
+    temp_config["database"] = _db_name(cog_instance)
+    try:
+        conn = await asyncpg.connect(**temp_config, timeout=10)
+    except asyncpg.InvalidCatalogNameError:
+        return list(migration_ids)
+    try:
+        rows = await conn.fetch(
+            "SELECT name FROM migration WHERE app_name = $1;",
+            _root(cog_instance).stem,
+        )
+    except asyncpg.UndefinedTableError:
+        return list(migration_ids)
+    finally:
+        await conn.close()
+    applied = {row["name"] for row in rows}
+    return [i for i in migration_ids if i not in applied]
+
+
+@lru_cache
+def _migration_ids(root: Path, fingerprint: tuple) -> tuple[str, ...] | None:
+    """Get the IDs of the cog's migration files, cached per fingerprint
+
+    Returns:
+        tuple[str, ...] | None: The migration IDs, or None if a file's ID couldn't be read
+    """
+    if not fingerprint:
+        return None
+    migration_ids = []
+    for name, _ in fingerprint:
+        text = (_migrations_folder(root) / name).read_text(encoding="utf-8")
+        match = migration_id_pattern.search(text)
+        if not match:
+            return None
+        migration_ids.append(match.group(1))
+    return tuple(migration_ids)
+
+
+def _migrations_fingerprint(cog_instance: Cog | Path) -> tuple:
+    """Get the name and modification time of each of the cog's migration files"""
+    folder = _migrations_folder(_root(cog_instance))
+    if not folder.is_dir():
+        return ()
+    return tuple(
+        sorted(
+            (file.name, file.stat().st_mtime_ns)
+            for file in folder.glob("*.py")
+            if file.name != "__init__.py"
+        )
+    )
+
+
+def _migrations_folder(root: Path) -> Path:
+    """Get the migrations folder of the cog"""
+    return root / "db" / "migrations"
+
+
+def _forget_migrated(database_name: str):
+    """Drop the cached migration state of a database"""
+    for entry in [i for i in _migrated if i[0] == database_name]:
+        _migrated.discard(entry)
+
+
 async def _acquire_db_engine(config: dict, extensions: list[str]) -> PostgresEngine:
     """Acquire a database engine
     The PostgresEngine constructor is blocking and must be run in a separate thread.
@@ -209,6 +440,8 @@ async def _acquire_db_engine(config: dict, extensions: list[str]) -> PostgresEng
     Returns:
         PostgresEngine: The database engine
     """
+    from piccolo.engine.postgres import PostgresEngine
+
     try:
         async with asyncio.timeout(10):
             return await asyncio.to_thread(
@@ -246,7 +479,9 @@ def _root(cog_instance: Cog | Path) -> Path:
     """Get the root path of the cog"""
     if isinstance(cog_instance, Path):
         return cog_instance
-    return Path(inspect.getfile(cog_instance.__class__)).parent
+    if cog_instance not in _roots:
+        _roots[cog_instance] = Path(inspect.getfile(cog_instance.__class__)).parent
+    return _roots[cog_instance]
 
 
 def _get_env(cog_instance: Cog | Path, config: dict) -> dict:
@@ -268,7 +503,9 @@ def _db_name(cog_instance: Cog | Path) -> str:
     """Get the name of the database for the cog"""
     if isinstance(cog_instance, Path):
         return cog_instance.stem.lower()
-    return cog_instance.qualified_name.lower()
+    if cog_instance not in _db_names:
+        _db_names[cog_instance] = cog_instance.qualified_name.lower()
+    return _db_names[cog_instance]
 
 
 def _is_unc_path(path: Path) -> bool:
@@ -8,3 +8,7 @@ class UNCPathError(Exception):
 
 class DirectoryError(Exception):
     message: str
+
+
+class MigrationLockError(Exception):
+    message: str
@@ -1,4 +1,4 @@
-from piccolo.columns import ForeignKey, Varchar
+from piccolo.columns import ForeignKey, Integer, Varchar
 from piccolo.table import Table, sort_table_classes
 
 
@@ -7,5 +7,8 @@ class Thing(Table):
 
 class OtherThing(Table):
     name = Varchar(length=50)
+
+class Counter(Table):
+    count = Integer()
     
-TABLES = sort_table_classes([Thing, OtherThing])
\ No newline at end of file
+TABLES = sort_table_classes([Thing, OtherThing, Counter])
\ No newline at end of file
@@ -0,0 +1,210 @@
+import asyncio
+import warnings
+from unittest import TestCase
+
+import asyncpg
+from piccolo.columns import BigInt, Integer
+from piccolo.engine.postgres import PostgresEngine
+from piccolo.table import Table
+from piccolo.utils.sync import run_sync
+
+from red_postgres.aggregator import CounterAggregator
+
+with warnings.catch_warnings():
+    # The engine is only needed for column types, it never connects
+    warnings.simplefilter("ignore")
+    db = PostgresEngine(config={})
+
+
+class Member(Table, db=db):
+    id = BigInt(primary_key=True)
+    messages = Integer()
+    xp = BigInt(db_column_name="total_xp")
+
+
+class StubConnection:
+    def __init__(self, engine):
+        self.engine = engine
+
+    async def execute(self, query, *args):
+        self.engine.queries.append((query, args))
+        if self.engine.commit_first:
+            # Commit on the server, then hold the reply
+            self.engine.stored = (self.engine.stored or 0) + sum(args[1])
+        if self.engine.gate is not None:
+            await self.engine.gate.wait()
+        if self.engine.error is not None:
+            raise self.engine.error
+        return f"UPDATE {len(args[0])}"
+
+    async def fetchval(self, query, *args):
+        self.engine.queries.append((query, args))
+        return self.engine.stored
+
+
+class StubPool:
+    def __init__(self, engine):
+        self.engine = engine
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return StubConnection(self.engine)
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class StubEngine:
+    def __init__(self):
+        self.pool = StubPool(self)
+        self.queries = []
+        self.gate: asyncio.Event | None = None
+        self.error: Exception | None = None
+        self.commit_first = False
+        self.stored = None
+
+
+class TestCounterAggregator(TestCase):
+
+    def setUp(self):
+        self.engine = StubEngine()
+        self.counters = CounterAggregator(self.engine, interval=0.01)
+
+    def test_increment_and_pending(self):
+        self.counters.increment(Member, 1, Member.messages)
+        self.counters.increment(Member, 1, "messages", 4)
+        self.counters.increment(Member, 2, Member.xp, 10)
+        self.assertEqual(self.counters.pending(Member, 1, Member.messages), 5)
+        self.assertEqual(self.counters.pending(Member, 2, "xp"), 10)
+        self.assertEqual(self.counters.pending(Member, 2, Member.messages), 0)
+        self.assertEqual(self.counters.pending(Member, 3, Member.messages), 0)
+
+    def test_get_merges_pending(self):
+        self.engine.stored = 7
+        self.counters.increment(Member, 1, Member.messages, 3)
+        value = run_sync(self.counters.get(Member, 1, Member.messages))
+        self.assertEqual(value, 10)
+        query, args = self.engine.queries[-1]
+        self.assertEqual(query, 'SELECT "messages" FROM "member" WHERE "id" = $1::BIGINT')
+        self.assertEqual(args, (1,))
+
+    def test_flush_update_query(self):
+        self.counters.increment(Member, 1, Member.messages, 2)
+        self.counters.increment(Member, 2, Member.xp, 5)
+        written = run_sync(self.counters.flush())
+        self.assertEqual(written, 2)
+        query, args = self.engine.queries[-1]
+        self.assertEqual(
+            query,
+            'UPDATE "member" AS t SET "messages" = t."messages" + v."messages", '
+            '"total_xp" = t."total_xp" + v."total_xp" '
+            'FROM unnest($1::BIGINT[], $2::INTEGER[], $3::BIGINT[]) AS v("id", "messages", "total_xp") '
+            'WHERE t."id" = v."id"',
+        )
+        self.assertEqual(args, ([1, 2], [2, 0], [0, 5]))
+        self.assertEqual(self.counters.pending(Member, 1, Member.messages), 0)
+
+    def test_flush_upsert_query(self):
+        self.counters.upsert = True
+        self.counters.increment(Member, 1, Member.messages)
+        run_sync(self.counters.flush())
+        query, args = self.engine.queries[-1]
+        self.assertEqual(
+            query,
+            'INSERT INTO "member" AS t ("id", "messages") '
+            'SELECT * FROM unnest($1::BIGINT[], $2::INTEGER[]) AS v("id", "messages") '
+            'ON CONFLICT ("id") DO UPDATE SET "messages" = t."messages" + EXCLUDED."messages"',
+        )
+        self.assertEqual(args, ([1], [1]))
+
+    def test_failed_flush_restores_deltas(self):
+        self.engine.error = ConnectionError("Stub failure")
+        self.counters.increment(Member, 1, Member.messages, 5)
+        with self.assertLogs("red.postgres.aggregator"):
+            written = run_sync(self.counters.flush())
+        self.assertEqual(written, 0)
+        self.assertEqual(self.counters.pending(Member, 1, Member.messages), 5)
+
+    def test_pending_includes_inflight(self):
+        async def _test():
+            self.engine.gate = asyncio.Event()
+            self.counters.increment(Member, 1, Member.messages, 5)
+            task = asyncio.create_task(self.counters.flush())
+            await asyncio.sleep(0)
+            self.counters.increment(Member, 1, Member.messages, 1)
+            self.assertEqual(self.counters.pending(Member, 1, Member.messages), 6)
+            self.engine.gate.set()
+            await task
+            return self.counters.pending(Member, 1, Member.messages)
+
+        self.assertEqual(run_sync(_test()), 1)
+
+    def test_close_flushes(self):
+        async def _test():
+            self.counters.interval = 60
+            self.counters.start()
+            self.counters.increment(Member, 1, Member.messages, 5)
+            await self.counters.close()
+
+        run_sync(_test())
+        self.assertEqual(len(self.engine.queries), 1)
+        self.assertEqual(self.engine.queries[0][1], ([1], [5]))
+
+    def test_close_during_flush_keeps_deltas(self):
+        async def _test():
+            self.engine.gate = asyncio.Event()
+            self.counters.increment(Member, 1, Member.messages, 5)
+            self.counters.start()
+            while not self.engine.queries:
+                await asyncio.sleep(0.01)
+            close = asyncio.create_task(self.counters.close())
+            await asyncio.sleep(0.01)
+            self.counters.increment(Member, 1, Member.messages, 2)
+            self.engine.gate.set()
+            await close
+
+        run_sync(_test())
+        self.assertEqual([q[1] for q in self.engine.queries], [([1], [5]), ([1], [2])])
+        self.assertEqual(self.counters.pending(Member, 1, Member.messages), 0)
+
+    def test_increment_rejects_invalid_amounts(self):
+        with self.assertRaises(TypeError):
+            self.counters.increment(Member, 1, Member.messages, 1.5)
+        with self.assertRaises(TypeError):
+            self.counters.increment(Member, 1, Member.messages, "1")
+        self.assertEqual(self.counters.pending(Member, 1, Member.messages), 0)
+
+    def test_rejected_flush_is_dropped(self):
+        self.engine.error = asyncpg.DataError("invalid input for query argument $1")
+        self.counters.increment(Member, 1, Member.messages, 5)
+        with self.assertLogs("red.postgres.aggregator"):
+            run_sync(self.counters.flush())
+        self.assertEqual(self.counters.pending(Member, 1, Member.messages), 0)
+        run_sync(self.counters.flush())
+        self.assertEqual(len(self.engine.queries), 1, "Rejected deltas should not be retried")
+
+    def test_get_during_flush(self):
+        async def _test():
+            self.engine.gate = asyncio.Event()
+            self.engine.commit_first = True
+            self.counters.increment(Member, 1, Member.messages, 5)
+            flush = asyncio.create_task(self.counters.flush())
+            await asyncio.sleep(0)
+            get = asyncio.create_task(self.counters.get(Member, 1, Member.messages))
+            await asyncio.sleep(0.01)
+            self.engine.gate.set()
+            await flush
+            return await get
+
+        self.assertEqual(run_sync(_test()), 5, "Committed deltas should not be counted twice")
+
+    def test_close_reports_unwritten(self):
+        self.engine.error = ConnectionError("Stub failure")
+        self.counters.increment(Member, 1, Member.messages, 5)
+        self.counters.increment(Member, 2, Member.messages, 1)
+        with self.assertLogs("red.postgres.aggregator"):
+            unwritten = run_sync(self.counters.close())
+        self.assertEqual(unwritten, 2)
+        self.assertEqual(self.counters.pending(Member, 1, Member.messages), 5)
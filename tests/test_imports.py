@@ -0,0 +1,20 @@
+import subprocess
+import sys
+from importlib.util import find_spec
+from pathlib import Path
+from unittest import TestCase, skipUnless
+
+root = Path(__file__).parent.parent
+installed = all(find_spec(name) is not None for name in ("asyncpg", "discord", "piccolo"))
+
+
+@skipUnless(installed, "asyncpg, discord and piccolo must be installed")
+class TestImports(TestCase):
+
+    def test_import_is_lightweight(self):
+        snippet = (
+            "import sys, red_postgres;"
+            "print([m for m in ('asyncpg', 'discord', 'piccolo.engine.postgres') if m in sys.modules])"
+        )
+        res = subprocess.run([sys.executable, "-c", snippet], stdout=subprocess.PIPE, check=True, cwd=str(root))
+        self.assertEqual(res.stdout.decode().strip(), "[]", "Heavy dependencies should be imported lazily")
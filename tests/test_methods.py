@@ -2,9 +2,10 @@ from unittest import TestCase
 
 from pathlib import Path
 from piccolo.engine.postgres import PostgresEngine
-from tests.tables import TABLES
+from tests.tables import TABLES, Counter
 from piccolo.utils.sync import run_sync
 import os
+from red_postgres.aggregator import CounterAggregator
 from red_postgres.engine import register_cog, run_migrations, create_migrations, diagnose_issues, ensure_database_exists, _acquire_db_engine
 from dotenv import load_dotenv
 
@@ -48,6 +49,26 @@ class TestCrud(TestCase):
     def test_diagnose_issues(self):
         res = run_sync(diagnose_issues(root, config))
         self.assertIsInstance(res, str, "Should return a string")
+
+    def test_counter_aggregator(self):
+        async def _test():
+            engine = await register_cog(root, config, TABLES)
+            try:
+                await Counter.create_table(if_not_exists=True)
+                row = Counter(count=0)
+                await row.save()
+                counters = CounterAggregator(engine)
+                for _ in range(5):
+                    counters.increment(Counter, row.id, Counter.count)
+                self.assertEqual(await counters.get(Counter, row.id, Counter.count), 5)
+                self.assertEqual(await counters.flush(), 1)
+                stored = await Counter.select(Counter.count).where(Counter.id == row.id).first()
+                self.assertEqual(stored["count"], 5, "Flush should write the aggregated deltas")
+                self.assertEqual(await counters.get(Counter, row.id, Counter.count), 5)
+            finally:
+                await engine.close_connection_pool()
+
+        run_sync(_test())
         
         
         
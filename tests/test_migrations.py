@@ -0,0 +1,93 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from piccolo.utils.sync import run_sync
+
+from red_postgres import engine
+
+# Nothing listens here, so anything that tries to connect fails straight away
+config = {"host": "127.0.0.1", "port": "1", "user": "postgres", "password": "postgres", "database": "postgres"}
+
+
+def write_migration(root: Path, name: str, migration_id: str | None):
+    folder = root / "db" / "migrations"
+    folder.mkdir(parents=True, exist_ok=True)
+    body = f'ID = "{migration_id}"\n' if migration_id else "VERSION = '1.0.0'\n"
+    (folder / name).write_text(f"from piccolo.apps.migrations.auto.migration_manager import MigrationManager\n\n{body}")
+
+
+class TestMigrationPlan(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name) / "mycog"
+        self.root.mkdir()
+        engine._migrated.clear()
+        engine._migration_ids.cache_clear()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        engine._migrated.clear()
+
+    def test_fingerprint_without_folder(self):
+        self.assertEqual(engine._migrations_fingerprint(self.root), ())
+
+    def test_fingerprint_lists_migration_files(self):
+        write_migration(self.root, "mycog_2024_01_02.py", "2024-01-02T00:00:00:000000")
+        write_migration(self.root, "mycog_2024_01_01.py", "2024-01-01T00:00:00:000000")
+        (self.root / "db" / "migrations" / "__init__.py").touch()
+        fingerprint = engine._migrations_fingerprint(self.root)
+        self.assertEqual([name for name, _ in fingerprint], ["mycog_2024_01_01.py", "mycog_2024_01_02.py"])
+
+    def test_migration_ids(self):
+        write_migration(self.root, "mycog_2024_01_01.py", "2024-01-01T00:00:00:000000")
+        write_migration(self.root, "mycog_2024_01_02.py", "2024-01-02T00:00:00:000000")
+        fingerprint = engine._migrations_fingerprint(self.root)
+        self.assertEqual(
+            engine._migration_ids(self.root, fingerprint),
+            ("2024-01-01T00:00:00:000000", "2024-01-02T00:00:00:000000"),
+        )
+
+    def test_migration_ids_unknown(self):
+        self.assertIsNone(engine._migration_ids(self.root, ()), "No migration files should be unknown")
+        write_migration(self.root, "mycog_2024_01_01.py", None)
+        fingerprint = engine._migrations_fingerprint(self.root)
+        self.assertIsNone(engine._migration_ids(self.root, fingerprint), "Unreadable IDs should be unknown")
+
+    def test_pending_migrations_unknown(self):
+        res = run_sync(engine._pending_migrations(self.root, config, ()))
+        self.assertIsNone(res, "Should not connect when the migration IDs are unknown")
+
+    def test_run_migrations_cached(self):
+        write_migration(self.root, "mycog_2024_01_01.py", "2024-01-01T00:00:00:000000")
+        engine._migrated.add(("mycog", engine._migrations_fingerprint(self.root)))
+        res = run_sync(engine.run_migrations(self.root, config))
+        self.assertIn("No migrations need to be run", res, "Cached cogs should return without connecting")
+
+    def test_cache_invalidated_by_new_migration(self):
+        write_migration(self.root, "mycog_2024_01_01.py", "2024-01-01T00:00:00:000000")
+        engine._migrated.add(("mycog", engine._migrations_fingerprint(self.root)))
+        write_migration(self.root, "mycog_2024_01_02.py", "2024-01-02T00:00:00:000000")
+        with self.assertRaises(OSError):
+            run_sync(engine.run_migrations(self.root, config))
+
+    def test_forget_migrated(self):
+        engine._migrated.update({("mycog", ()), ("other", ())})
+        engine._forget_migrated("mycog")
+        self.assertEqual(engine._migrated, {("other", ())})
+
+    def test_parallel_collects_exceptions(self):
+        other = Path(self.tmp.name) / "othercog"
+        other.mkdir()
+        for root in (self.root, other):
+            write_migration(root, "migration.py", "2024-01-01T00:00:00:000000")
+        engine._migrated.add(("mycog", engine._migrations_fingerprint(self.root)))
+        with self.assertLogs("red.postgres"):
+            res = run_sync(engine.run_migrations_parallel([self.root, other], config))
+        self.assertIn("No migrations need to be run", res["mycog"])
+        self.assertIsInstance(res["othercog"], OSError)
+
+    def test_parallel_duplicate_names(self):
+        with self.assertRaises(ValueError):
+            run_sync(engine.run_migrations_parallel([self.root, self.root], config))